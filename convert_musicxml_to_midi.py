@@ -11,6 +11,7 @@ Usage
 Dependencies
 ------------
     pip install music21
+    pip install partitura   # optional – faster, but drops instrument data
 """
 
 import argparse
@@ -19,23 +20,64 @@ import sys
 from pathlib import Path
 
 # --------------------------------------------------------------------------- #
-#  Helper function – all the heavy lifting lives here
+#  Helper functions – all the heavy lifting lives here
 # --------------------------------------------------------------------------- #
-def musicxml_to_midi(xml_path: Path, midi_path: Path, program: int = None) -> None:
+ENGINES = ("music21", "partitura")
+
+
+def _convert_with_partitura(xml_path: Path, midi_path: Path) -> None:
     """
-    Convert a MusicXML file to a MIDI file.
+    Convert using partitura's compiled MusicXML reader.
 
-    Parameters
-    ----------
-    xml_path : Path
-        Path to the source MusicXML file.
-    midi_path : Path
-        Path where the resulting MIDI file will be written.
-    program : int, optional
-        Global MIDI program (0‑127) to apply to every part.  If omitted, the
-        program information embedded in the MusicXML (if any) is preserved.
+    Faster than music21, but ``save_score_midi`` ignores the instruments in
+    the file: every part is written on channel 0 with no program change, and
+    all notes get velocity 64.
+    """
+    import partitura as pt
+
+    try:
+        score = pt.load_musicxml(str(xml_path), force_note_ids=False)
+    except Exception as exc:
+        raise RuntimeError(f"Failed to parse MusicXML: {exc}") from exc
+
+    try:
+        pt.save_score_midi(score, str(midi_path))
+    except Exception as exc:
+        raise RuntimeError(f"Failed to write MIDI: {exc}") from exc
+
+
+def _override_programs(mf, program: int) -> None:
+    """
+    Force every channel of a music21 ``MidiFile`` to use ``program``.
+
+    Existing PROGRAM_CHANGE events are rewritten in place; channels that
+    play notes without ever selecting a program get one at time zero.
     """
-    from music21 import converter, midi
+    from music21.midi import ChannelVoiceMessages, DeltaTime, MidiEvent
+
+    for track in mf.tracks:
+        programmed, sounding = set(), set()
+        for event in track.events:
+            if event.type == ChannelVoiceMessages.PROGRAM_CHANGE:
+                event.data = program
+                programmed.add(event.channel)
+            elif event.type == ChannelVoiceMessages.NOTE_ON:
+                sounding.add(event.channel)
+
+        for channel in sorted(sounding - programmed):
+            change = MidiEvent(track, ChannelVoiceMessages.PROGRAM_CHANGE,
+                               channel=channel)
+            change.data = program
+            track.events[0:0] = [DeltaTime(track, time=0, channel=channel), change]
+
+
+def _convert_with_music21(xml_path: Path, midi_path: Path, program: int = None) -> None:
+    """Convert using music21 (slower, but supports program overrides)."""
+    from music21 import converter
+    from music21.midi.translate import streamToMidiFile
+
+    if program is not None and not 0 <= program <= 127:
+        raise ValueError("Program number must be in the range 0‑127.")
 
     # Load the MusicXML file.  `converter.parse` understands the format by
     # file extension and will use musicxml parsing internally.
@@ -44,25 +86,59 @@ def musicxml_to_midi(xml_path: Path, midi_path: Path, program: int = None) -> No
     except Exception as exc:
         raise RuntimeError(f"Failed to parse MusicXML: {exc}") from exc
 
-    # Optionally override all instruments with a single program.
-    if program is not None:
-        if not 0 <= program <= 127:
-            raise ValueError("Program number must be in the range 0‑127.")
-        for part in score.parts:
-            part.insert(0, midi.ProgramChange(program, part.id))
-
-    # Write the MIDI file.  `score.write` accepts a format identifier.
+    # Translate to a MidiFile ourselves (rather than `score.write('midi')`)
+    # so a program override is a cheap edit of the MIDI event lists instead
+    # of inserting objects into the score streams.
     try:
-        score.write('midi', str(midi_path))
+        mf = streamToMidiFile(score)
+        if program is not None:
+            _override_programs(mf, program)
+        mf.open(str(midi_path), 'wb')
+        try:
+            mf.write()
+        finally:
+            mf.close()
     except Exception as exc:
         raise RuntimeError(f"Failed to write MIDI: {exc}") from exc
 
+
+def musicxml_to_midi(
+    xml_path: Path, midi_path: Path, program: int = None, engine: str = "music21"
+) -> None:
+    """
+    Convert a MusicXML file to a MIDI file.
+
+    Parameters
+    ----------
+    xml_path : Path
+        Path to the source MusicXML file.
+    midi_path : Path
+        Path where the resulting MIDI file will be written.
+    program : int, optional
+        Global MIDI program (0‑127) to apply to every part.  If omitted, the
+        program information embedded in the MusicXML (if any) is preserved.
+    engine : str, optional
+        ``"music21"`` (default) or ``"partitura"``.  partitura parses large
+        files much faster but drops the parts' programs and channels (every
+        part ends up on channel 0) and writes all notes at velocity 64, so
+        the embedded program information is *not* preserved with it.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'; expected one of {ENGINES}.")
+
+    if engine == "partitura":
+        if program is not None:
+            raise ValueError("Program overrides require the music21 engine.")
+        _convert_with_partitura(xml_path, midi_path)
+    else:
+        _convert_with_music21(xml_path, midi_path, program)
+
 # --------------------------------------------------------------------------- #
 #  CLI handling
 # --------------------------------------------------------------------------- #
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Convert MusicXML → MIDI using music21."
+        description="Convert MusicXML → MIDI using partitura or music21."
     )
     parser.add_argument(
         "--input_xml",
@@ -80,6 +156,13 @@ def main() -> None:
         default=None,
         help="Optional global MIDI program (0‑127) to apply to all parts.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="music21",
+        help="Parsing backend (default: music21).  partitura is faster but "
+             "drops instrument programs/channels and note velocities.",
+    )
     args = parser.parse_args()
 
     # Basic sanity checks
@@ -96,7 +179,9 @@ def main() -> None:
 
     # Perform conversion
     try:
-        musicxml_to_midi(args.input_xml, args.output_midi, args.program)
+        musicxml_to_midi(
+            args.input_xml, args.output_midi, args.program, args.engine
+        )
         print(f"✅  Successfully created {args.output_midi}")
     except Exception as exc:
         print(f"❌  Conversion failed: {exc}")
@@ -1,153 +1,351 @@
-#!/usr/bin/env python3
-"""
-download_lutheran_hymn_sheet_music.py
-
-Downloads sheet‑music PDFs for a list of Lutheran hymns from IMSLP.org.
-
-Author: <your name or open‑source community>
-License: MIT / public domain (as per IMSLP policy)
-"""
-
-import os
-import sys
-import time
-import logging
-import pathlib
-import urllib.parse
-
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-
-# --------------------------------------------------------------------------- #
-# Configuration – edit these values before running
-# --------------------------------------------------------------------------- #
-
-# List of hymn titles.  Use the English title (or any title that is known to
-# appear on IMSLP).  Feel free to add/remove titles.
-HYMNS = [
-    "Annie Laurie",          # example of a popular public‑domain hymn
-    "Rock Of Ages",
-    "The Old Rugged Cross",
-    "Amazing Grace",
-    "Blessed Assurance",
-    "Crown Him with Many Crowns",
-    # ... add as many as you want
-]
-
-# Directory that will hold the downloaded PDFs
-OUT_DIR = pathlib.Path("lutheran_hymn_scores")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-
-# Minimum time (in seconds) to wait between requests – keeps us polite to IMSLP
-MIN_DELAY = 1.5
-
-# Logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
-
-# --------------------------------------------------------------------------- #
-# Helpers
-# --------------------------------------------------------------------------- #
-
-HEADERS = {
-    "User-Agent": (
-        "LutheranHymnDownloader/1.0 "
-        "(https://github.com/yourrepo/yourproject; contact: your@email)"
-    )
-}
-
-
-def safe_sleep(previous_time):
-    """Sleep to respect MIN_DELAY between consecutive requests."""
-    elapsed = time.time() - previous_time
-    if elapsed < MIN_DELAY:
-        time.sleep(MIN_DELAY - elapsed)
-
-
-def build_score_page_url(title: str) -> str:
-    """Construct the likely IMSLP score page URL for a given title."""
-    # IMSLP uses underscores in URLs.  Replace spaces and strip punctuation.
-    safe_title = title.replace(" ", "_")
-    return f"https://imslp.org/wiki/{safe_title}"
-
-
-def fetch(url: str, session: requests.Session) -> requests.Response:
-    """GET a URL, following redirects, and return the Response object."""
-    response = session.get(url, headers=HEADERS)
-    response.raise_for_status()
-    return response
-
-
-def find_pdf_link(soup: BeautifulSoup) -> str | None:
-    """
-    Look for the first PDF link on an IMSLP score page.
-    Returns the absolute URL or None if not found.
-    """
-    # The PDF link is usually a <a> tag that ends with ".pdf"
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.lower().endswith(".pdf"):
-            return urllib.parse.urljoin("https://imslp.org", href)
-    return None
-
-
-def download_pdf(pdf_url: str, dest_path: pathlib.Path, session: requests.Session):
-    """Download a PDF file to the destination path."""
-    with session.get(pdf_url, headers=HEADERS, stream=True) as r:
-        r.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-
-
-# --------------------------------------------------------------------------- #
-# Main logic
-# --------------------------------------------------------------------------- #
-
-def main():
-    session = requests.Session()
-
-    last_request_time = time.time() - MIN_DELAY  # so first request goes straight through
-
-    for hymn in tqdm(HYMNS, desc="Processing hymns"):
-        safe_sleep(last_request_time)
-        last_request_time = time.time()
-
-        score_page_url = build_score_page_url(hymn)
-        logging.info(f"Searching for hymn page: {score_page_url}")
-
-        try:
-            resp = fetch(score_page_url, session)
-        except requests.HTTPError as exc:
-            logging.warning(f"Could not fetch page for '{hymn}': {exc}")
-            continue
-
-        soup = BeautifulSoup(resp.text, "html.parser")
-
-        pdf_link = find_pdf_link(soup)
-        if not pdf_link:
-            logging.warning(f"No PDF link found for '{hymn}'.")
-            continue
-
-        logging.info(f"Found PDF: {pdf_link}")
-
-        # Create a file‑friendly name
-        safe_name = "_".join(part for part in hymn.split() if part.isalnum())
-        dest_file = OUT_DIR / f"{safe_name}.pdf"
-
-        try:
-            download_pdf(pdf_link, dest_file, session)
-            logging.info(f"Downloaded to: {dest_file}")
-        except requests.HTTPError as exc:
-            logging.error(f"Failed to download PDF for '{hymn}': {exc}")
-
-    logging.info("All done. PDF files are in: %s", OUT_DIR)
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+"""
+download_lutheran_hymn_sheet_music.py
+
+Downloads sheet‑music PDFs for a list of Lutheran hymns from IMSLP.org.
+
+Author: <your name or open‑source community>
+License: MIT / public domain (as per IMSLP policy)
+
+Dependencies
+------------
+    pip install "httpx[http2]" aiofiles orjson tqdm
+    pip install uvloop   # optional – faster event loop (Linux/macOS only)
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import pathlib
+import urllib.parse
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+# Third‑party modules (httpx, aiofiles, orjson, tqdm) are imported inside the
+# functions that use them, so `--help` does not pay for loading them.
+if TYPE_CHECKING:
+    import httpx
+
+# --------------------------------------------------------------------------- #
+# Configuration – edit these values before running
+# --------------------------------------------------------------------------- #
+
+# List of hymn titles.  Use the English title (or any title that is known to
+# appear on IMSLP).  Feel free to add/remove titles.
+HYMNS = [
+    "Annie Laurie",          # example of a popular public‑domain hymn
+    "Rock Of Ages",
+    "The Old Rugged Cross",
+    "Amazing Grace",
+    "Blessed Assurance",
+    "Crown Him with Many Crowns",
+    # ... add as many as you want
+]
+
+# Directory that will hold the downloaded PDFs
+OUT_DIR = pathlib.Path("lutheran_hymn_scores")
+
+# Validators (ETag / Last‑Modified) and PDF links of previous IMSLP lookups,
+# so unchanged pages can be revalidated with a header‑only round trip
+HTTP_CACHE_FILE = OUT_DIR / ".http_cache.json"
+
+# Maximum number of hymns processed at the same time
+MAX_CONCURRENCY = 8
+
+# Maximum sustained requests per second to any one host – keeps us polite to
+# IMSLP.  Up to MAX_CONCURRENCY requests may burst through at once.
+RATE_LIMIT = 2.0
+
+# Retry policy for transient failures: connection errors and these HTTP
+# statuses are retried up to MAX_RETRIES times, backing off exponentially
+# (BACKOFF_FACTOR * 2**attempt seconds) between attempts.
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection pool size shared by all requests
+POOL_MAXSIZE = 20
+
+# Bytes written per chunk when saving PDFs (1 MiB keeps Python‑level
+# iterations and write() calls to a handful per file)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# --------------------------------------------------------------------------- #
+# Helpers
+# --------------------------------------------------------------------------- #
+
+HEADERS = {
+    "User-Agent": (
+        "LutheranHymnDownloader/1.0 "
+        "(https://github.com/yourrepo/yourproject; contact: your@email)"
+    )
+}
+
+# Runs of characters that are not safe in a file name
+UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9]+")
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second, in bursts of `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent, then consume one token."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def throttle(url: str, limiters: dict):
+    """Wait until the rate limiter for `url`'s host allows a request."""
+    await limiters[urllib.parse.urlsplit(url).netloc].acquire()
+
+
+def build_score_api_url(title: str) -> str:
+    """
+    Construct the IMSLP MediaWiki API URL that lists the external links
+    (including the PDF files) of the score page for a given title.
+    """
+    # IMSLP uses underscores in page titles.
+    params = {
+        "action": "parse",
+        "page": title.replace(" ", "_"),
+        "prop": "externallinks",
+        "redirects": 1,
+        "format": "json",
+    }
+    return f"https://imslp.org/api.php?{urllib.parse.urlencode(params)}"
+
+
+def load_http_cache(path: pathlib.Path) -> dict:
+    """Load the lookup cache, or start an empty one if it is missing/corrupt."""
+    import orjson
+
+    try:
+        return orjson.loads(path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+
+def save_http_cache(path: pathlib.Path, cache: dict):
+    """Persist the lookup cache (best effort)."""
+    import orjson
+
+    try:
+        path.write_bytes(orjson.dumps(cache, option=orjson.OPT_INDENT_2))
+    except OSError as exc:
+        logging.warning(f"Could not save HTTP cache to {path}: {exc}")
+
+
+async def send_with_retries(url: str, client: httpx.AsyncClient, limiters: dict,
+                            stream: bool = False, headers: dict | None = None) -> httpx.Response:
+    """
+    GET a URL, retrying on RETRY_STATUSES, and return the Response object.
+    With `stream=True` the body is not read; the caller must close it.
+    A 304 Not Modified is returned rather than raised.
+    """
+    request = client.build_request("GET", url, headers=headers, timeout=15)
+    for attempt in range(MAX_RETRIES + 1):
+        await throttle(url, limiters)
+        response = await client.send(request, stream=stream)
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            break
+        await response.aclose()
+        await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+    if response.is_error:
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+async def find_pdf_link(api_url: str, client: httpx.AsyncClient, limiters: dict,
+                        http_cache: dict) -> str | None:
+    """
+    Look for the first PDF link of an IMSLP score page via the MediaWiki API.
+    Returns the absolute URL or None if not found.
+
+    If `http_cache` holds validators for `api_url` the request is made
+    conditional, and a 304 reuses the cached link without parsing anything.
+    """
+    import orjson
+
+    cached = http_cache.get(api_url, {})
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await send_with_retries(api_url, client, limiters, headers=headers)
+    if response.status_code == 304:
+        return cached.get("pdf_link")
+
+    data = orjson.loads(response.content)
+
+    # Unknown pages come back as {"error": {...}} rather than an HTTP error
+    pdf_link = None
+    for href in data.get("parse", {}).get("externallinks", []):
+        if href.lower().endswith(".pdf"):
+            pdf_link = urllib.parse.urljoin("https://imslp.org", href)
+            break
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        http_cache[api_url] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "pdf_link": pdf_link,
+        }
+    return pdf_link
+
+
+async def download_pdf(pdf_url: str, dest_path: pathlib.Path,
+                       client: httpx.AsyncClient, limiters: dict):
+    """
+    Stream a PDF file to the destination path.  The file only appears under
+    its final name once complete, so an interrupted download is retried on
+    the next run instead of being mistaken for a finished one.
+    """
+    import aiofiles
+
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    r = await send_with_retries(pdf_url, client, limiters, stream=True)
+    try:
+        async with aiofiles.open(part_path, "wb") as f:
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+    finally:
+        await r.aclose()
+    part_path.replace(dest_path)
+
+
+# --------------------------------------------------------------------------- #
+# Main logic
+# --------------------------------------------------------------------------- #
+
+async def process_hymn(hymn: str, client: httpx.AsyncClient,
+                       semaphore: asyncio.Semaphore, limiters: dict,
+                       http_cache: dict):
+    """Find and download the PDF for a single hymn."""
+    import httpx
+    import orjson
+
+    # Create a file‑friendly name
+    safe_name = UNSAFE_FILENAME_CHARS.sub("_", hymn).strip("_")
+    dest_file = OUT_DIR / f"{safe_name}.pdf"
+    if dest_file.exists():
+        logging.info(f"Already downloaded '{hymn}': {dest_file}")
+        return
+
+    async with semaphore:
+        score_api_url = build_score_api_url(hymn)
+        logging.info(f"Searching for hymn page: {score_api_url}")
+
+        try:
+            pdf_link = await find_pdf_link(score_api_url, client, limiters, http_cache)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as exc:
+            logging.warning(f"Could not fetch page for '{hymn}': {exc}")
+            return
+
+        if not pdf_link:
+            logging.warning(f"No PDF link found for '{hymn}'.")
+            return
+
+        logging.info(f"Found PDF: {pdf_link}")
+
+        try:
+            await download_pdf(pdf_link, dest_file, client, limiters)
+            logging.info(f"Downloaded to: {dest_file}")
+        except (httpx.HTTPError, OSError) as exc:
+            # OSError covers local failures (disk full, permissions, rename)
+            # so one bad hymn does not abort the others.
+            logging.error(f"Failed to download PDF for '{hymn}': {exc}")
+
+
+async def main_async():
+    import httpx
+    from tqdm.asyncio import tqdm
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # One token bucket per host, so PDF mirrors don't eat IMSLP's budget
+    limiters = defaultdict(lambda: RateLimiter(RATE_LIMIT, burst=MAX_CONCURRENCY))
+    http_cache = load_http_cache(HTTP_CACHE_FILE)
+
+    # A single pooled transport reuses TCP/TLS connections across all
+    # requests and retries failed connection attempts.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,
+        limits=httpx.Limits(
+            max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE
+        ),
+    )
+
+    async with httpx.AsyncClient(
+        transport=transport,
+        headers=HEADERS,
+        follow_redirects=True,
+    ) as client:
+        try:
+            await tqdm.gather(
+                *(process_hymn(hymn, client, semaphore, limiters, http_cache)
+                  for hymn in HYMNS),
+                desc="Processing hymns",
+            )
+        finally:
+            # Keep the revalidation data gathered so far even if the run
+            # is interrupted.
+            save_http_cache(HTTP_CACHE_FILE, http_cache)
+
+    logging.info("All done. PDF files are in: %s", OUT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download sheet‑music PDFs for the configured hymns from IMSLP."
+    )
+    parser.parse_args()
+
+    # Logging configuration
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)-8s | %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    # uvloop is a drop‑in, libuv‑based event loop; fall back to asyncio's
+    # own loop where it is not available (e.g. on Windows).
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main_async())
+    else:
+        uvloop.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,122 +3,160 @@
 play_sheet_on_organ.py
 ----------------------
 Parse a MusicXML/MIDI/ABC file and stream it in real time to a MIDI‑capable digital organ.
+
+Usage
+-----
+    python play_sheet_on_organ.py --score score.xml --port "YourOrganMidiPort"
 """
 
+import argparse
+import heapq
 import sys
-import time
-import mido
-from music21 import converter, note, chord, stream
+from pathlib import Path
 
 # ------------------------------------------------------------------
-# 1️⃣  Configuration -------------------------------------------------
+# 1️⃣  Configuration (defaults for the command‑line options) ---------
 # ------------------------------------------------------------------
 SCORE_FILE = "score.xml"           # <-- change to your file (MusicXML, MIDI, ABC, etc.)
 MIDI_PORT_NAME = "YourOrganMidiPort"  # <-- the name of the MIDI port your organ listens on
 ORGAN_CHANNEL = 1                 # MIDI channel (1‑16); most organs use channel 1
 ORGAN_KEY_OFFSET = 0              # if your organ uses a different key numbering
-TIME_RESOLUTION = 0.05            # seconds per quarter‑note (adjust for tempo)
-
-# ------------------------------------------------------------------
-# 2️⃣  Open the MIDI port --------------------------------------------
-# ------------------------------------------------------------------
-try:
-    midi_out = mido.open_output(MIDI_PORT_NAME, virtual=False)
-except OSError as e:
-    print(f"ERROR: Could not open MIDI port '{MIDI_PORT_NAME}'.")
-    print(f"Available ports: {mido.get_input_names()} (input) | {mido.get_output_names()} (output)")
-    sys.exit(1)
-
-print(f"[+] Connected to MIDI port: {MIDI_PORT_NAME}")
-
-# ------------------------------------------------------------------
-# 3️⃣  Load and parse the score ------------------------------------
-# ------------------------------------------------------------------
-try:
-    score = converter.parse(SCORE_FILE)
-except Exception as e:
-    print(f"ERROR: Could not parse '{SCORE_FILE}': {e}")
-    sys.exit(1)
-
-print(f"[+] Loaded score '{SCORE_FILE}'")
-
-# ------------------------------------------------------------------
-# 4️⃣  Flatten the score to a stream of notes/chords ----------------
-# ------------------------------------------------------------------
-flat_notes = score.flat.notesAndRests
-print(f"[+] Score contains {len(flat_notes)} note/rest objects")
 
-# ------------------------------------------------------------------
-# 5️⃣  Helper: convert a music21 element to MIDI events -------------
-# ------------------------------------------------------------------
-def note_to_midi_events(m21_note, start_tick):
-    """
-    Given a music21 Note or Rest, return a list of MIDI messages
-    (note_on, note_off) with correct timings.
-    """
-    events = []
 
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Stream a score in real time to a MIDI‑capable digital organ."
+    )
+    parser.add_argument(
+        "--score",
+        type=Path,
+        default=Path(SCORE_FILE),
+        help="Score to play (MusicXML, MIDI, ABC, etc.).",
+    )
+    parser.add_argument(
+        "--port",
+        default=MIDI_PORT_NAME,
+        help="Name of the MIDI port the organ listens on.",
+    )
+    parser.add_argument(
+        "--channel",
+        type=int,
+        default=ORGAN_CHANNEL,
+        choices=range(1, 17),
+        metavar="{1‑16}",
+        help="MIDI channel (1‑16); most organs use channel 1.",
+    )
+    parser.add_argument(
+        "--key_offset",
+        type=int,
+        default=ORGAN_KEY_OFFSET,
+        help="Semitones added to every note, for organs with different key numbering.",
+    )
+    args = parser.parse_args()
+
+    if not args.score.is_file():
+        parser.error(f"Score file does not exist: {args.score}")
+
+    # Heavy imports are deferred until the arguments are known to be valid,
+    # so `--help` and usage errors return immediately.
+    import mido
+    import numpy as np
+
+    from score_io import load_or_parse, quarters_to_seconds, to_midi_file
+
+    # ------------------------------------------------------------------
+    # 2️⃣  Open the MIDI port --------------------------------------------
+    # ------------------------------------------------------------------
+    try:
+        midi_out = mido.open_output(args.port, virtual=False)
+    except OSError as e:
+        print(f"ERROR: Could not open MIDI port '{args.port}'.")
+        print(f"Available ports: {mido.get_input_names()} (input) | {mido.get_output_names()} (output)")
+        sys.exit(1)
+
+    print(f"[+] Connected to MIDI port: {args.port}")
+
+    # ------------------------------------------------------------------
+    # 3️⃣  Load and parse the score ------------------------------------
+    # ------------------------------------------------------------------
+    # The score is parsed once and cached as a compact note table, so repeat
+    # runs skip the (slow) MusicXML parse entirely.
+    try:
+        notes, tempos = load_or_parse(args.score)
+    except Exception as e:
+        print(f"ERROR: Could not parse '{args.score}': {e}")
+        sys.exit(1)
+
+    print(f"[+] Loaded score '{args.score}'")
+
+    # Rests‑only scores and drum‑only MIDI files leave an empty note table.
+    if not len(notes["pitch"]):
+        print("[+] Score contains no notes – nothing to play.")
+        midi_out.close()
+        return
+
+    # ------------------------------------------------------------------
+    # 4️⃣  Build the organ‑voice event table ----------------------------
+    # ------------------------------------------------------------------
+    # Use the highest note sounding at each onset as the organ “voice”: the
+    # top note struck there, unless a higher note struck earlier is still
+    # held – then the melody stays on that note and the onset is skipped.
+    order = np.lexsort((-notes["pitch"].astype(np.int16), notes["onset"]))
+    sorted_onsets = notes["onset"][order].tolist()
+    sorted_ends = (notes["onset"] + notes["dur"])[order].tolist()
+    sorted_pitches = notes["pitch"][order].tolist()
+
+    held = []       # max‑heap of (-pitch, end) for every note struck so far
+    keep = []
+    i = 0
+    while i < len(order):
+        onset, top = sorted_onsets[i], sorted_pitches[i]
+        while held and held[0][1] <= onset:
+            heapq.heappop(held)     # released before this onset
+        if not held or -held[0][0] <= top:
+            keep.append(i)
+        while i < len(order) and sorted_onsets[i] == onset:
+            heapq.heappush(held, (-sorted_pitches[i], sorted_ends[i]))
+            i += 1
+    melody = {name: column[order][keep] for name, column in notes.items()}
+
+    # Use the tempo map from the score (120 BPM where it has none)
+    if len(tempos):
+        print(f"[+] Tempo found: {len(tempos)} marking(s), starting at "
+              f"{tempos['bpm'][0]:g} BPM")
+
+    # Convert each column to playback units (seconds / MIDI values) with
+    # vectorised NumPy operations.
+    onsets = quarters_to_seconds(melody["onset"], tempos)
+    durations = quarters_to_seconds(melody["onset"] + melody["dur"], tempos) - onsets
+    pitches = melody["pitch"].astype(np.int16) + args.key_offset
+    velocities = melody["vel"].astype(np.int16)
+
+    # A single voice cannot overlap itself: cut each note off at the next
+    # melody onset (skipped onsets leave the held note untouched).
+    durations = np.minimum(durations, np.diff(onsets, append=np.inf))
+    print(f"[+] Score contains {len(onsets)} melody notes")
+
+    # ------------------------------------------------------------------
+    # 5️⃣  Render the event table to a MIDI file ------------------------
+    # ------------------------------------------------------------------
     # MIDI channel (0‑based)
-    chan = ORGAN_CHANNEL - 1
-
-    if isinstance(m21_note, note.Rest):
-        # Just skip rests – no MIDI message
-        duration = m21_note.duration.quarterLength
-        return events, duration
-
-    # For chords, pick the highest pitch (or use all voices)
-    if isinstance(m21_note, chord.Chord):
-        # Use the highest note in the chord as the organ “voice”
-        pitches = sorted(m21_note.pitches, key=lambda p: p.midi)
-        midi_pitch = pitches[-1].midi
-    else:
-        midi_pitch = m21_note.pitch.midi
-
-    # Apply key offset (if needed)
-    midi_pitch += ORGAN_KEY_OFFSET
+    chan = args.channel - 1
+    midi_file = to_midi_file(onsets, durations, pitches, velocities, channel=chan)
 
-    # Compute velocity (0–127)
-    velocity = int(m21_note.volume.velocity) if m21_note.volume.velocity else 64
+    # ------------------------------------------------------------------
+    # 6️⃣  Main playback loop --------------------------------------------
+    # ------------------------------------------------------------------
+    print("[+] Starting playback …")
 
-    duration = m21_note.duration.quarterLength
-
-    # Build MIDI messages
-    events.append(mido.Message('note_on', note=midi_pitch, velocity=velocity,
-                               channel=chan, time=start_tick))
-    events.append(mido.Message('note_off', note=midi_pitch, velocity=0,
-                               channel=chan, time=duration * 1000))  # mido uses ms
+    # `MidiFile.play()` sleeps out the delta times itself and skips meta
+    # messages, so the loop only has to forward each message to the organ.
+    for msg in midi_file.play():
+        midi_out.send(msg)
 
-    return events, duration
+    print("[+] Playback finished. Closing MIDI port.")
+    midi_out.close()
 
-# ------------------------------------------------------------------
-# 6️⃣  Main playback loop --------------------------------------------
-# ------------------------------------------------------------------
-# Convert quarterLength to milliseconds per quarter
-ms_per_quarter = 60000 / 120  # default 120 BPM -> you can read tempo from the score
-# Use tempo from the score if present
-if score.metronomeMarkBoundaries:
-    # Take the first tempo marking
-    bpm = score.metronomeMarkBoundaries[0][2].number
-    ms_per_quarter = 60000 / bpm
-    print(f"[+] Tempo found: {bpm} BPM (ms/quarter={ms_per_quarter:.2f})")
-
-print("[+] Starting playback …")
-
-for idx, m21_obj in enumerate(flat_notes):
-    # Determine how many ticks (ms) to wait before sending the next event
-    # We use absolute time for simplicity; more complex scheduling can be added
-    events, dur = note_to_midi_events(m21_obj, 0)
-    if not events:
-        # It's a rest; just sleep
-        time.sleep(dur * TIME_RESOLUTION)
-        continue
-
-    # Send events
-    for msg in events:
-        # mido's send() expects relative time (time in ticks); we set it directly
-        midi_out.send(msg)
-        # Wait for the message duration (convert ms to seconds)
-        time.sleep(msg.time / 1000.0)
 
-print("[+] Playback finished. Closing MIDI port.")
-midi_out.close()
+if __name__ == "__main__":
+    main()
@@ -3,122 +3,195 @@
 play_sheet_on_virtual_organ.py
 --------------------------------
 Parse a MusicXML/MIDI/ABC file and stream it in real time to a *virtual* organ
-(using FluidSynth) that plays through the computer's speakers.
+(using FluidSynth) that plays through the computer's speakers – or, with
+--output_wav, render it offline to a WAV file (needs `pip install soundfile`).
+
+Usage
+-----
+    python play_sheet_on_virtual_organ.py --score 469.mxl --soundfont organ.sf2
 """
 
+import argparse
 import sys
-import time
-import mido
-from music21 import converter, note, chord, stream
-import fluidsynth
+from pathlib import Path
 
 # ----------------------------------------------------------------------
-# 1️⃣  Configuration
+# 1️⃣  Configuration (defaults for the command‑line options)
 # ----------------------------------------------------------------------
 SCORE_FILE = "469.mxl"                # <-- change to your file
 SOUND_FONT = "Organteq_Church_Organ.sf2"                # <-- path to an organ soundfont
 ORGAN_PROGRAM = 1                       # GM program number for a pipe organ
 TEMPO_BPM = None                         # If None, read from the score
+OUTPUT_WAV = None                        # e.g. "out.wav" to render to a file instead of playing
+SAMPLE_RATE = 44100                      # Hz, used for both live and offline output
+RELEASE_TAIL = 2.0                       # seconds rendered after the last note‑off
 
-# ----------------------------------------------------------------------
-# 2️⃣  Open FluidSynth
-# ----------------------------------------------------------------------
-try:
-    fs = fluidsynth.Synth()
-    fs.start(driver="dsound")  # On Windows use "dsound", on macOS use "coreaudio"
-    sfid = fs.sfload(SOUND_FONT)
-    if sfid == -1:
-        raise RuntimeError(f"Could not load soundfont '{SOUND_FONT}'")
-    fs.program_select(0, sfid, 0, ORGAN_PROGRAM)  # channel 0, organ program
-except Exception as e:
-    print(f"[ERROR] Failed to initialise FluidSynth: {e}")
-    sys.exit(1)
-
-print(f"[+] FluidSynth started – using '{SOUND_FONT}' (program {ORGAN_PROGRAM})")
-
-# ----------------------------------------------------------------------
-# 3️⃣  Load and parse the score
-# ----------------------------------------------------------------------
-try:
-    score = converter.parse(SCORE_FILE)
-except Exception as e:
-    print(f"[ERROR] Could not read score '{SCORE_FILE}': {e}")
-    sys.exit(1)
-
-# If the user supplied a tempo, override whatever is in the file
-if TEMPO_BPM is not None:
-    bpm = TEMPO_BPM
-else:
-    # Pull the first MetronomeMark from the file; fall back to 120 if absent
-    met_mark = score.metronomeMarkBoundaries()
-    # print(met_mark)
-    # print(dir(met_mark[0][2]))
-    # print(met_mark[0][2].getQuarterBPM())
-    bpm = met_mark[0][2].getQuarterBPM() if met_mark else 120
-
-print(f"[+] Score parsed – tempo set to {bpm} BPM")
 
 # ----------------------------------------------------------------------
-# 4️⃣  Helper: convert a music21 element into one or more FluidSynth note
-#      events (with proper timing)
+# Helper: render the whole score offline
 # ----------------------------------------------------------------------
-def play_element(el, time_offset):
+def render_to_wav(fs, onsets, durations, pitches, path):
     """
-    el: music21 Element (Note or chord)
-    time_offset: how many seconds to wait *before* this element starts
+    Synthesize the note table on `fs` as fast as FluidSynth can and write it
+    to `path`.  No audio driver is involved, so the result is deterministic.
     """
-    # Wait until the start time of this element
-    print(time_offset)
-    print(el)
-    time.sleep(time_offset)
-
-    if isinstance(el, note.Note):
-        pitch = el.pitch.midi
-        duration = el.quarterLength  # in quarter‑lengths
-
-        # FluidSynth expects values 0–127
-        fs.noteon(0, pitch, 127)          # channel 0, note on, max velocity
-        # Wait for the note’s duration
-        time.sleep(duration * (60.0 / bpm))
-        fs.noteoff(0, pitch)
-
-    elif isinstance(el, chord.Chord):
-        # Organs are monophonic, but we still want to honour every voice.
-        # For a realistic pipe‑organ, we could let each voice go to its own
-        # channel; here we simply play all voices on the same channel.
-        dur = el.quarterLength
-        pitches = [p.midi for p in el.pitches]
-        for p in pitches:
-            fs.noteon(0, p, 127)
-        time.sleep(dur * (60.0 / bpm))
-        for p in pitches:
+    import numpy as np
+    import soundfile
+
+    # Pre‑pass: merge note‑ons and note‑offs into one timeline (in frames)
+    # and group them per frame, so every chord is one array of pitches and
+    # get_samples() is called once per distinct event time.
+    on_frames = np.rint(onsets * SAMPLE_RATE).astype(np.int64)
+    off_frames = np.rint((onsets + durations) * SAMPLE_RATE).astype(np.int64)
+    # Notes shorter than a frame would be released before they are struck.
+    keep = off_frames > on_frames
+    on_frames, off_frames = on_frames[keep], off_frames[keep]
+    pitches = np.asarray(pitches)[keep]
+
+    n = len(pitches)
+    frames = np.concatenate([off_frames, on_frames])
+    is_on = np.concatenate([np.zeros(n, bool), np.ones(n, bool)])
+    order = np.lexsort((is_on, frames))
+    frames, is_on = frames[order], is_on[order]
+    event_pitches = np.tile(pitches, 2)[order].astype(np.int64)
+
+    splits = np.flatnonzero(np.diff(frames)) + 1
+    group_frames = frames[np.r_[0, splits]].tolist() if n else []
+    chord_pitches = np.split(event_pitches, splits)
+    chord_is_on = np.split(is_on, splits)
+
+    blocks = []
+    rendered = 0    # frames synthesized so far
+    for frame, chord, on in zip(group_frames, chord_pitches, chord_is_on):
+        if frame > rendered:
+            blocks.append(fs.get_samples(frame - rendered))
+            rendered = frame
+        # Note‑offs first, so a repeated pitch is re‑struck
+        for p in chord[~on].tolist():
             fs.noteoff(0, p)
-
-# ----------------------------------------------------------------------
-# 4️⃣  Stream the score note‑by‑note
-# ----------------------------------------------------------------------
-# Flatten the score so we get a simple timeline of elements.
-flat = score.flat
-
-# We’ll keep a running clock (seconds) to know when to fire each event.
-# This keeps the code *independent* of FluidSynth’s own clock.
-start_time = time.perf_counter()
-current_offset = 0.0  # seconds
-
-# Convert tempo to seconds‑per‑quarter‑note
-seconds_per_quarter = 60.0 / bpm
-
-# Iterate through all musical elements that have timing info.
-# We ignore rests – the clock is driven by the durations of the previous
-# note(s).
-for el in flat.getElementsByClass(['Note', 'Chord']):
-    # The element already carries a `.duration.quarterLength`.
-    duration_q = el.duration.quarterLength
-    # Wait until the element’s start time
-    # (the loop itself naturally respects the duration of the *previous* note)
-    play_element(el, current_offset)
-    # Advance the clock by this element’s duration
-    current_offset += duration_q * seconds_per_quarter
-
-print("[+] Playback finished – shutting down FluidSynth.")
-fs.delete()
+        for p in chord[on].tolist():
+            fs.noteon(0, p, 127)
+    blocks.append(fs.get_samples(int(RELEASE_TAIL * SAMPLE_RATE)))
+
+    # get_samples returns interleaved stereo int16
+    audio = np.concatenate(blocks).reshape(-1, 2)
+    soundfile.write(path, audio, SAMPLE_RATE)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Play a score on a FluidSynth virtual organ."
+    )
+    parser.add_argument(
+        "--score",
+        type=Path,
+        default=Path(SCORE_FILE),
+        help="Score to play (MusicXML, MIDI, ABC, etc.).",
+    )
+    parser.add_argument(
+        "--soundfont",
+        type=Path,
+        default=Path(SOUND_FONT),
+        help="Path to an organ soundfont (.sf2).",
+    )
+    parser.add_argument(
+        "--program",
+        type=int,
+        default=ORGAN_PROGRAM,
+        help="GM program number for the organ voice.",
+    )
+    parser.add_argument(
+        "--tempo",
+        type=float,
+        default=TEMPO_BPM,
+        help="Fixed tempo in BPM (default: follow the score).",
+    )
+    parser.add_argument(
+        "--output_wav",
+        type=Path,
+        default=OUTPUT_WAV,
+        help="Render to this WAV file instead of playing live.",
+    )
+    args = parser.parse_args()
+
+    if not args.score.is_file():
+        parser.error(f"Score file does not exist: {args.score}")
+    if not args.soundfont.is_file():
+        parser.error(f"Soundfont does not exist: {args.soundfont}")
+
+    # Heavy imports are deferred until the arguments are known to be valid,
+    # so `--help` and usage errors return immediately.
+    import fluidsynth
+    import numpy as np
+
+    from score_io import TEMPO_DTYPE, load_or_parse, quarters_to_seconds, to_midi_file
+
+    # ----------------------------------------------------------------------
+    # 2️⃣  Open FluidSynth
+    # ----------------------------------------------------------------------
+    try:
+        fs = fluidsynth.Synth(samplerate=SAMPLE_RATE)
+        if args.output_wav is None:
+            fs.start(driver="dsound")  # On Windows use "dsound", on macOS use "coreaudio"
+        sfid = fs.sfload(str(args.soundfont))
+        if sfid == -1:
+            raise RuntimeError(f"Could not load soundfont '{args.soundfont}'")
+        fs.program_select(0, sfid, 0, args.program)  # channel 0, organ program
+    except Exception as e:
+        print(f"[ERROR] Failed to initialise FluidSynth: {e}")
+        sys.exit(1)
+
+    print(f"[+] FluidSynth started – using '{args.soundfont}' (program {args.program})")
+
+    # ----------------------------------------------------------------------
+    # 3️⃣  Load and parse the score
+    # ----------------------------------------------------------------------
+    # The note table is cached on disk, so only the first run pays for parsing.
+    try:
+        notes, tempos = load_or_parse(args.score)
+    except Exception as e:
+        print(f"[ERROR] Could not read score '{args.score}': {e}")
+        sys.exit(1)
+
+    # If the user supplied a tempo, override whatever is in the file
+    if args.tempo is not None:
+        tempos = np.array([(0.0, args.tempo)], dtype=TEMPO_DTYPE)
+
+    # Follow every tempo change in the file; fall back to 120 if absent
+    bpm = float(tempos["bpm"][0]) if len(tempos) else 120
+    print(f"[+] Score parsed – tempo set to {bpm:g} BPM"
+          + (f" ({len(tempos)} tempo changes)" if len(tempos) > 1 else ""))
+
+    # ----------------------------------------------------------------------
+    # 4️⃣  Convert the note table to seconds
+    # ----------------------------------------------------------------------
+    # Convert quarter‑note offsets to seconds through the tempo map
+    onsets = quarters_to_seconds(notes["onset"], tempos)
+    durations = quarters_to_seconds(notes["onset"] + notes["dur"], tempos) - onsets
+    pitches = notes["pitch"]
+
+    # ----------------------------------------------------------------------
+    # 5️⃣  Stream the score to FluidSynth (or render it)
+    # ----------------------------------------------------------------------
+    if args.output_wav is not None:
+        render_to_wav(fs, onsets, durations, pitches, args.output_wav)
+        print(f"[+] Rendered to '{args.output_wav}' – shutting down FluidSynth.")
+    else:
+        # Every voice is played at max velocity on the same channel.
+        midi_file = to_midi_file(onsets, durations, pitches,
+                                 np.full(len(pitches), 127))
+
+        # `MidiFile.play()` sleeps out the delta times between messages, so the
+        # loop only has to hand each note event to FluidSynth (channel 0).
+        for msg in midi_file.play():
+            if msg.type == "note_on":
+                fs.noteon(0, msg.note, msg.velocity)
+            elif msg.type == "note_off":
+                fs.noteoff(0, msg.note)
+
+        print("[+] Playback finished – shutting down FluidSynth.")
+    fs.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+score_io.py
+
+Shared score loading for the playback scripts.
+
+MIDI files are read with symusic's C++ parser when it is installed;
+everything else (MusicXML, ABC…) goes through music21.  Either way the
+notes of a score are flattened into a compact NumPy table – one contiguous
+array per column – and cached on disk under ``~/.cache/lmt/``, so the slow
+music21 parse only happens once per file.  The cache key is derived from
+the file's path, modification time and size and from the parser used, so
+editing the score or installing/removing symusic invalidates it.
+
+Dependencies
+------------
+    pip install music21 mido numpy
+    pip install symusic   # optional – much faster MIDI parsing
+"""
+
+import hashlib
+import importlib.util
+from pathlib import Path
+
+import mido
+import numpy as np
+
+# --------------------------------------------------------------------------- #
+#  Table layouts
+# --------------------------------------------------------------------------- #
+# Notes are stored column‑wise: a dict mapping each column name to a 1‑D
+# array, all of the same length.  One entry per sounding pitch (chords are
+# exploded into one entry per voice); onsets and durations are measured in
+# quarter notes.
+NOTE_COLUMNS = {
+    "pitch": np.uint8,
+    "onset": np.float32,
+    "dur": np.float32,
+    "vel": np.uint8,
+}
+
+# One row per tempo marking: the offset (in quarter notes) where it takes
+# effect and the tempo in quarter notes per minute.
+TEMPO_DTYPE = np.dtype([
+    ("offset", "f4"),
+    ("bpm", "f4"),
+])
+
+# symusic also reads ABC, but humanises it (jittered chord onsets, accented
+# velocities), so ABC files are left to music21.
+SYMUSIC_SUFFIXES = {".mid", ".midi"}
+
+CACHE_DIR = Path.home() / ".cache" / "lmt"
+# Bump whenever the table layout or its contents change, so stale cache
+# files are ignored rather than misread.
+CACHE_VERSION = 5
+DEFAULT_VELOCITY = 64
+DEFAULT_BPM = 120
+
+# Resolution of the MIDI files built by `to_midi_file`: at 120 BPM and 480
+# ticks per beat one tick is ~1 ms.
+TICKS_PER_BEAT = 480
+MIDI_TEMPO = mido.bpm2tempo(120)
+
+
+# --------------------------------------------------------------------------- #
+#  Helpers
+# --------------------------------------------------------------------------- #
+def _backend(path: Path) -> str:
+    """Return the name of the parser that will read ``path``."""
+    if (path.suffix.lower() in SYMUSIC_SUFFIXES
+            and importlib.util.find_spec("symusic") is not None):
+        return "symusic"
+    return "music21"
+
+
+def _cache_path(path: Path, backend: str) -> Path:
+    """Return the cache file for ``path``, keyed by path, mtime, size and parser."""
+    stat = path.stat()
+    key = hashlib.blake2b(
+        f"{CACHE_VERSION}:{backend}:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        .encode()
+    ).hexdigest()
+    return CACHE_DIR / f"{key}.npz"
+
+
+def _note_table(pitch, onset, dur, vel):
+    """Build a column‑wise note table, sorted by onset."""
+    columns = {"pitch": pitch, "onset": onset, "dur": dur, "vel": vel}
+    notes = {
+        name: np.asarray(columns[name], dtype=dtype)
+        for name, dtype in NOTE_COLUMNS.items()
+    }
+    order = np.argsort(notes["onset"], kind="stable")
+    return {name: col[order] for name, col in notes.items()}
+
+
+def _tempo_table(offsets, bpms):
+    """Build the tempo table, keeping the last marking at any given offset."""
+    marks = dict(zip(np.asarray(offsets, float).tolist(),
+                     np.asarray(bpms, float).tolist()))
+    return np.array(sorted(marks.items()), dtype=TEMPO_DTYPE)
+
+
+def _parse_with_music21(path: Path):
+    """Parse ``path`` with music21 and flatten it into note/tempo tables."""
+    from music21 import converter
+
+    score = converter.parse(str(path))
+
+    # Merge tied notes part by part (so a tie never pairs with a note in
+    # another part), then flatten once for both notes and tempo marks.
+    flat = score.stripTies().flatten()
+    events = list(flat.getElementsByClass(("Note", "Chord")))
+
+    pitch, onset, dur, vel = [], [], [], []
+    for el in events:
+        # Grace notes take no time of their own; at the main note's onset
+        # they would only compete with it (and never be released).
+        if el.duration.isGrace or el.duration.quarterLength == 0:
+            continue
+        el_vel = int(el.volume.velocity) if el.volume.velocity else DEFAULT_VELOCITY
+        for p in el.pitches:
+            pitch.append(p.midi)
+            onset.append(float(el.offset))
+            dur.append(float(el.duration.quarterLength))
+            vel.append(el_vel)
+    notes = _note_table(pitch, onset, dur, vel)
+
+    # Parts often repeat the same marking; keep one tempo per offset.
+    marks = list(flat.getElementsByClass("MetronomeMark"))
+    tempos = _tempo_table([mm.offset for mm in marks],
+                          [mm.getQuarterBPM() for mm in marks])
+    return notes, tempos
+
+
+def _parse_with_symusic(path: Path):
+    """Read a MIDI file with symusic and flatten it into note/tempo tables."""
+    from symusic import Score
+
+    # ttype="quarter" makes symusic report every time in quarter notes.
+    score = Score(str(path), ttype="quarter")
+
+    tracks = [t.notes.numpy() for t in score.tracks if not t.is_drum]
+    tracks = [t for t in tracks if len(t["time"])]
+
+    def column(name):
+        if not tracks:
+            return np.empty(0)
+        return np.concatenate([t[name] for t in tracks])
+
+    notes = _note_table(column("pitch"), column("time"),
+                        column("duration"), column("velocity"))
+
+    tempo_events = score.tempos.numpy()
+    # Tempos come as microseconds per quarter note.
+    tempos = _tempo_table(tempo_events["time"], 60_000_000 / tempo_events["mspq"])
+    return notes, tempos
+
+
+# --------------------------------------------------------------------------- #
+#  Public API
+# --------------------------------------------------------------------------- #
+def load_or_parse(path):
+    """
+    Load the note and tempo tables for a score, parsing it only if needed.
+
+    Parameters
+    ----------
+    path : str or Path
+        A MIDI file, or a score in any format music21 understands
+        (MusicXML, ABC…).
+
+    Returns
+    -------
+    notes : dict of np.ndarray
+        One array per ``NOTE_COLUMNS`` entry, sorted by onset.
+    tempos : np.ndarray
+        Structured array with dtype ``TEMPO_DTYPE``; may be empty.
+    """
+    path = Path(path).resolve()
+    backend = _backend(path)
+    cache_file = _cache_path(path, backend)
+
+    if cache_file.is_file():
+        try:
+            with np.load(cache_file) as data:
+                notes = {name: data[name] for name in NOTE_COLUMNS}
+                return notes, data["tempos"]
+        except (OSError, KeyError, ValueError):
+            pass  # corrupt or stale layout – fall through and re-parse
+
+    if backend == "symusic":
+        notes, tempos = _parse_with_symusic(path)
+    else:
+        notes, tempos = _parse_with_music21(path)
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_file, tempos=tempos, **notes)
+    except OSError:
+        pass  # caching is best effort only
+
+    return notes, tempos
+
+
+def quarters_to_seconds(offsets, tempos, default_bpm=DEFAULT_BPM):
+    """
+    Convert score offsets to playback time using the score's tempo map.
+
+    Parameters
+    ----------
+    offsets : np.ndarray
+        Positions in quarter notes.
+    tempos : np.ndarray
+        Tempo table (``TEMPO_DTYPE``); each marking holds until the next one.
+    default_bpm : float, optional
+        Tempo used before the first marking, or throughout if there is none.
+
+    Returns
+    -------
+    np.ndarray
+        Positions in seconds from the start of the score.
+    """
+    offsets = np.asarray(offsets, dtype=np.float64)
+    starts = tempos["offset"].astype(np.float64)
+    bpms = tempos["bpm"].astype(np.float64)
+    if not len(starts) or starts[0] > 0:
+        starts = np.r_[0.0, starts]
+        bpms = np.r_[default_bpm, bpms]
+
+    # Seconds per quarter within each tempo segment, and the time (s) at
+    # which each segment begins.
+    spq = 60.0 / bpms
+    segment_start = np.r_[0.0, np.cumsum(np.diff(starts) * spq[:-1])]
+
+    seg = np.searchsorted(starts, offsets, side="right") - 1
+    return segment_start[seg] + (offsets - starts[seg]) * spq[seg]
+
+
+def to_midi_file(onsets, durations, pitches, velocities, channel=0):
+    """
+    Build an in‑memory MIDI file from a note event table.
+
+    Parameters
+    ----------
+    onsets, durations : np.ndarray
+        Note start times and lengths in seconds.
+    pitches, velocities : np.ndarray
+        MIDI note numbers and velocities (0‑127).
+    channel : int, optional
+        0‑based MIDI channel for every note.
+
+    Returns
+    -------
+    mido.MidiFile
+        Single‑track file whose delta times reproduce ``onsets``.
+    """
+    ticks_per_second = mido.second2tick(1.0, TICKS_PER_BEAT, MIDI_TEMPO)
+    on_ticks = np.rint(onsets * ticks_per_second).astype(np.int64)
+    off_ticks = np.rint((onsets + durations) * ticks_per_second).astype(np.int64)
+
+    # Drop notes that round to zero ticks: their note‑off would sort before
+    # their own note‑on and leave the key held forever.
+    keep = off_ticks > on_ticks
+    on_ticks, off_ticks = on_ticks[keep], off_ticks[keep]
+    pitches, velocities = np.asarray(pitches)[keep], np.asarray(velocities)[keep]
+
+    # Note‑offs sort before note‑ons at the same tick so repeats re‑strike;
+    # every note‑off now ends a note that started on an earlier tick.
+    n = len(on_ticks)
+    ticks = np.concatenate([off_ticks, on_ticks])
+    is_on = np.concatenate([np.zeros(n, bool), np.ones(n, bool)])
+    order = np.lexsort((is_on, ticks))
+    deltas = np.diff(ticks[order], prepend=0)
+
+    track = mido.MidiTrack()
+    track.append(mido.MetaMessage("set_tempo", tempo=MIDI_TEMPO))
+    for delta, idx in zip(deltas.tolist(), order.tolist()):
+        note = int(pitches[idx % n])
+        if is_on[idx]:
+            track.append(mido.Message("note_on", note=note, channel=channel,
+                                      velocity=int(velocities[idx % n]),
+                                      time=delta))
+        else:
+            track.append(mido.Message("note_off", note=note, channel=channel,
+                                      velocity=0, time=delta))
+
+    mf = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    mf.tracks.append(track)
+    return mf